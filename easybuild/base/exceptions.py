@@ -33,6 +33,7 @@ Authors:
 import inspect
 import logging
 import os
+import sys
 
 from easybuild.base import fancylogger
 
@@ -52,17 +53,25 @@ def get_callers_logger():
     # frame may be None, see https://docs.python.org/2/library/inspect.html#inspect.currentframe
     if frame is not None:
         try:
-            # consider calling stack in reverse order, i.e. most inner frame (closest to caller) first
-            for frameinfo in inspect.getouterframes(frame)[::-1]:
-                bindings = inspect.getargvalues(frameinfo[0]).locals
+            # collect frames in calling stack by walking up via f_back,
+            # which is a lot cheaper than inspect.getouterframes (which also reads source code for each frame)
+            frames = []
+            while frame is not None:
+                frames.append(frame)
+                frame = frame.f_back
+
+            # consider calling stack in reverse order
+            for outer_frame in frames[::-1]:
+                bindings = outer_frame.f_locals
                 for val in bindings.values():
                     if isinstance(val, logger_cls):
                         logger = val
                         break
         finally:
-            # make very sure that reference to frame object is removed, to avoid reference cycles
+            # make very sure that references to frame objects are removed, to avoid reference cycles
             # see https://docs.python.org/2/library/inspect.html#the-interpreter-stack
             del frame
+            frames = outer_frame = None
 
     return logger
 
@@ -100,12 +109,15 @@ class LoggedException(Exception):
 
             if self.INCLUDE_LOCATION:
                 # figure out where error was raised from
-                # current frame: this constructor, one frame above: location where LoggedException was created/raised
-                frameinfo = inspect.getouterframes(inspect.currentframe())[frames_up]
+                # current frame: this constructor, one frame above: location where LoggedException was created/raised;
+                # only the frame we need is retrieved, no need to collect info on all outer frames
+                frame = sys._getframe(frames_up)
+                filename, lineno, func_name = frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name
+                del frame
 
                 # determine short location of Python module where error was raised from,
                 # i.e. starting with an entry from LOC_INFO_TOP_PKG_NAMES
-                path_parts = frameinfo[1].split(os.path.sep)
+                path_parts = filename.split(os.path.sep)
                 if path_parts[0] == '':
                     path_parts[0] = os.path.sep
                 top_indices = [path_parts.index(n) for n in self.LOC_INFO_TOP_PKG_NAMES if n in path_parts]
@@ -113,7 +125,7 @@ class LoggedException(Exception):
 
                 # include location info at the end of the message
                 # for example: "Nope, giving up (at easybuild/tools/somemodule.py:123 in some_function)"
-                msg = "%s (at %s:%s in %s)" % (msg, relpath, frameinfo[2], frameinfo[3])
+                msg = "%s (at %s:%s in %s)" % (msg, relpath, lineno, func_name)
 
         logger = kwargs.get('logger', None)
         # try to use logger defined in caller's environment
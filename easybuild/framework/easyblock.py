@@ -88,7 +88,7 @@ from easybuild.tools.hooks import BUILD_STEP, CLEANUP_STEP, CONFIGURE_STEP, EXTE
 from easybuild.tools.hooks import MODULE_STEP, MODULE_WRITE, PACKAGE_STEP, PATCH_STEP, PERMISSIONS_STEP, POSTITER_STEP
 from easybuild.tools.hooks import POSTPROC_STEP, PREPARE_STEP, READY_STEP, SANITYCHECK_STEP, SOURCE_STEP
 from easybuild.tools.hooks import SINGLE_EXTENSION, TEST_STEP, TESTCASES_STEP, load_hooks, run_hook
-from easybuild.tools.run import check_async_cmd, run_cmd
+from easybuild.tools.run import check_async_cmd, run_cmd, wait_for_async_cmds
 from easybuild.tools.jenkins import write_to_xml
 from easybuild.tools.module_generator import ModuleGeneratorLua, ModuleGeneratorTcl, module_generator, dependencies_for
 from easybuild.tools.module_naming_scheme.utilities import det_full_ec_version
@@ -1833,6 +1833,7 @@ class EasyBlock(object):
         print_msg("skipping installed extensions (in parallel)", log=self.log)
 
         async_cmd_info_cache = {}
+        async_cmd_output_cache = {}
         running_checks_ids = []
         installed_exts_ids = []
         exts_queue = list(enumerate(self.ext_instances[:]))
@@ -1842,11 +1843,21 @@ class EasyBlock(object):
         # asynchronously run checks to see whether extensions are already installed
         while exts_queue or running_checks_ids:
 
+            # wait until output is available for any of the running checks (or until they completed),
+            # rather than continuously checking on all of them;
+            # if no output became available in time, check on all of them anyway
+            running_procs = [async_cmd_info_cache[idx][0] for idx in running_checks_ids]
+            ready_procs = wait_for_async_cmds(running_procs, timeout=1)
+
             # first handle completed checks
             for idx in running_checks_ids[:]:
                 ext_name = self.ext_instances[idx].name
-                # don't read any output, just check whether command completed
-                async_cmd_info = check_async_cmd(*async_cmd_info_cache[idx], output_read_size=0, fail_on_error=False)
+                # only read output if it is available (to avoid blocking),
+                # otherwise just check whether command completed
+                read_size = 1024 if async_cmd_info_cache[idx][0] in ready_procs else 0
+                async_cmd_info = check_async_cmd(*async_cmd_info_cache[idx], output_read_size=read_size,
+                                                 output=async_cmd_output_cache[idx], fail_on_error=False)
+                async_cmd_output_cache[idx] = async_cmd_info['output']
                 if async_cmd_info['done']:
                     out, ec = async_cmd_info['output'], async_cmd_info['exit_code']
                     self.log.info("exts_filter result for %s: exit code %s; output: %s", ext_name, ec, out)
@@ -1866,6 +1877,7 @@ class EasyBlock(object):
                 cmd, stdin = resolve_exts_filter_template(exts_filter, ext)
                 async_cmd_info_cache[idx] = run_cmd(cmd, log_all=False, log_ok=False, simple=False, inp=stdin,
                                                     regexp=False, trace=False, asynchronous=True)
+                async_cmd_output_cache[idx] = ''
                 running_checks_ids.append(idx)
 
         # compose new list of extensions, skip over the ones that are already installed;
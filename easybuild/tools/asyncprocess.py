@@ -68,11 +68,11 @@ Authors:
 """
 
 import errno
-import fcntl
 import os
 import select
 import subprocess
-import time
+
+from easybuild.tools.py2vs3 import monotonic
 
 PIPE = subprocess.PIPE
 STDOUT = subprocess.STDOUT
@@ -88,11 +88,11 @@ class Popen(subprocess.Popen):
         kwargs['bufsize'] = 0
         super(Popen, self).__init__(*args, **kwargs)
 
-    def recv(self, maxsize=None):
-        return self._recv('stdout', maxsize)
+    def recv(self, maxsize=None, timeout=0):
+        return self._recv('stdout', maxsize, timeout=timeout)
 
-    def recv_err(self, maxsize=None):
-        return self._recv('stderr', maxsize)
+    def recv_err(self, maxsize=None, timeout=0):
+        return self._recv('stderr', maxsize, timeout=timeout)
 
     def send_recv(self, inp='', maxsize=None):
         return self.send(inp), self.recv(maxsize), self.recv_err(maxsize)
@@ -124,45 +124,47 @@ class Popen(subprocess.Popen):
 
         return written
 
-    def _recv(self, which, maxsize):
+    def _recv(self, which, maxsize, timeout=0):
         conn, maxsize = self.get_conn_maxsize(which, maxsize)
         if conn is None:
             return None
 
-        flags = fcntl.fcntl(conn, fcntl.F_GETFL)
-        if not conn.closed:
-            fcntl.fcntl(conn, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        # wait (at most timeout seconds) until output is available
+        if not select.select([conn], [], [], timeout)[0]:
+            return ''
 
+        # read directly from the file descriptor: once select reports it as readable,
+        # os.read returns whatever is available (up to maxsize) without blocking,
+        # so there's no need to (temporarily) switch the pipe to non-blocking mode
         try:
-            if not select.select([conn], [], [], 0)[0]:
+            r = os.read(conn.fileno(), maxsize)
+        except OSError as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
                 return ''
+            raise
 
-            r = conn.read(maxsize)
-            if not r:
-                return self._close(which)
+        if not r:
+            return self._close(which)
 
-            if self.universal_newlines:
-                r = self._translate_newlines(r)
-            return r
-        finally:
-            if not conn.closed:
-                fcntl.fcntl(conn, fcntl.F_SETFL, flags)
+        if self.universal_newlines:
+            r = self._translate_newlines(r)
+        return r
 
 
 message = "Other end disconnected!"
 
 
 def recv_some(p, t=.2, e=1, tr=5, stderr=0):
-    if tr < 1:
-        tr = 1
-    x = time.time() + t
+    # note: tr (number of times to check for output) is no longer used, we just wait until output is available
+    x = monotonic() + t
     y = []
     r = ''
     pr = p.recv
     if stderr:
         pr = p.recv_err
-    while time.time() < x or r:
-        r = pr()
+    while monotonic() < x or r:
+        # wait for output to become available (until time is up), rather than polling and sleeping in between
+        r = pr(timeout=max(x - monotonic(), 0))
         if r is None:
             if e:
                 raise Exception(message)
@@ -170,8 +172,6 @@ def recv_some(p, t=.2, e=1, tr=5, stderr=0):
                 break
         elif r:
             y.append(r)
-        else:
-            time.sleep(max((x - time.time()) / tr, 0))
     return b''.join(y)
 
 
@@ -57,6 +57,9 @@ reload = reload  # noqa: F821
 # string type that can be used in 'isinstance' calls
 string_type = basestring
 
+# monotonic clock is only available in Python 3.3 and newer, fall back to regular wall-clock time
+monotonic = time.time
+
 # trivial wrapper for json.loads (Python 3 version is less trivial)
 json_loads = json.loads
 
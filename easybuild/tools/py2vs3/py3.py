@@ -45,6 +45,7 @@ from html.parser import HTMLParser  # noqa
 from itertools import zip_longest
 from io import StringIO  # noqa
 from os import makedirs  # noqa
+from time import monotonic  # noqa
 from string import ascii_letters, ascii_lowercase  # noqa
 from urllib.request import HTTPError, HTTPSHandler, Request, URLError, build_opener, urlopen  # noqa
 from urllib.parse import urlencode  # noqa
@@ -101,6 +102,12 @@ def subprocess_terminate(proc, timeout):
             if pipe:
                 pipe.close()
         proc.terminate()
+        # reap terminated process, only escalate to killing it if it doesn't terminate in time
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait(timeout=timeout)
 
 
 def raise_with_traceback(exception_class, message, traceback):
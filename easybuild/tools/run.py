@@ -37,9 +37,10 @@ Authors:
 """
 import contextlib
 import functools
+import itertools
 import os
 import re
-import signal
+import select
 import subprocess
 import sys
 import tempfile
@@ -51,7 +52,7 @@ from easybuild.base import fancylogger
 from easybuild.tools.build_log import EasyBuildError, dry_run_msg, print_msg, time_str_since
 from easybuild.tools.config import ERROR, IGNORE, WARN, build_option
 from easybuild.tools.hooks import RUN_SHELL_CMD, load_hooks, run_hook
-from easybuild.tools.py2vs3 import string_type
+from easybuild.tools.py2vs3 import monotonic, string_type
 from easybuild.tools.utilities import nub, trace_msg
 
 
@@ -64,7 +65,7 @@ errors_found_in_log = 0
 strictness = WARN
 
 
-CACHED_COMMANDS = [
+CACHED_COMMANDS = frozenset([
     "sysctl -n hw.cpufrequency_max",  # used in get_cpu_speed (OS X)
     "sysctl -n hw.memsize",  # used in get_total_memory (OS X)
     "sysctl -n hw.ncpu",  # used in get_avail_core_count (OS X)
@@ -73,7 +74,38 @@ CACHED_COMMANDS = [
     "type module",  # used in ModulesTool.check_module_function
     "type _module_raw",  # used in EnvironmentModules.check_module_function
     "ulimit -u",  # used in det_parallelism
-]
+])
+
+# maximum number of bytes of output to read at once from pipe for a running command (see complete_cmd);
+# since reading from the pipe returns whatever output is available, a large read size does not cause any delays,
+# and it helps to reduce the number of read calls for commands that produce lots of output (64KB is the
+# default capacity of a pipe on Linux)
+PIPE_READ_SIZE = 64 * 1024
+# smaller read size that is used when output of command is streamed, to make it stream more fluently
+PIPE_READ_SIZE_STREAM = 4 * 1024
+
+# size of tail of output of interactive commands that is considered when looking for questions;
+# all question patterns are anchored at the end of the output, so there's no need to scan all output every time
+QA_OUTPUT_TAIL_SIZE = 16 * 1024
+
+# suffix for patterns of questions (and non-questions) in interactive commands,
+# to allow trailing whitespace (incl. newlines) at the end of the output
+QA_PATTERN_SUFFIX = r'\s*$'
+
+# whitespace (incl. newlines) in questions for interactive commands is replaced by this pattern
+# in the corresponding regular expression, so any amount of whitespace matches
+QA_WHITESPACE_PATTERN = r'[\s\n]+'
+QA_WHITESPACE_REGEX = re.compile(QA_WHITESPACE_PATTERN)
+
+# maximum number of groups in a single regular expression in Python 2 (incl. group 0, which is the whole match),
+# see combine_regexes; there's no such limit in Python 3
+PY2_MAX_REGEX_GROUPS = 100
+
+# default regular expression used to check output of commands for errors (see parse_log_for_error)
+DEFAULT_ERROR_REGEX = re.compile(r"(?<![(,-]|\w)(?:error|segmentation fault|failed)(?![(,-]|\.?\w)", re.I)
+
+# cache for path to bash shell provided in alternate sysroot (see get_sysroot_bash)
+_sysroot_bash_cache = {}
 
 
 def run_cmd_cache(func):
@@ -83,10 +115,14 @@ def run_cmd_cache(func):
     @functools.wraps(func)
     def cache_aware_func(cmd, *args, **kwargs):
         """Retrieve cached result of selected commands, or run specified and collect & cache result."""
+        # only cmd strings are cached, no need to bother with cache key for other commands
+        if not isinstance(cmd, string_type):
+            return func(cmd, *args, **kwargs)
+
         # cache key is combination of command and input provided via stdin
         key = (cmd, kwargs.get('inp', None))
-        # fetch from cache if available, cache it if it's not, but only on cmd strings
-        if isinstance(cmd, string_type) and key in cache:
+        # fetch from cache if available, cache it if it's not
+        if key in cache:
             _log.debug("Using cached value for command '%s': %s", cmd, cache[key])
             return cache[key]
         else:
@@ -102,13 +138,100 @@ def run_cmd_cache(func):
     return cache_aware_func
 
 
-def get_output_from_process(proc, read_size=None, asynchronous=False):
+def get_sysroot_bash(sysroot):
+    """
+    Return path to bash shell provided in specified sysroot, or None if it's not available.
+
+    Result is cached per sysroot, to avoid checking the filesystem again for every command being run.
+    """
+    if sysroot not in _sysroot_bash_cache:
+        sysroot_bin_bash = os.path.join(sysroot, 'bin', 'bash')
+        if os.path.exists(sysroot_bin_bash):
+            _sysroot_bash_cache[sysroot] = sysroot_bin_bash
+        else:
+            _sysroot_bash_cache[sysroot] = None
+
+    return _sysroot_bash_cache[sysroot]
+
+
+def decode_output(output):
+    """
+    Decode (raw) output of a command to a string value.
+
+    :param output: output to decode (bytes)
+    """
+    # need to be careful w.r.t. encoding since we want to obtain a string value,
+    # and the output may include non UTF-8 characters
+    # * in Python 2, .decode() returns a value of type 'unicode',
+    #   but we really want a regular 'str' value (which is also why we use 'ignore' for encoding errors)
+    # * in Python 3, .decode() returns a 'str' value when called on the 'bytes' value obtained from .read()
+    return str(output.decode('ascii', 'ignore'))
+
+
+def encode_log_msg(msg):
+    """
+    Encode message to write to (binary) log file for output of a command, if it's not a bytes value already.
+
+    :param msg: message to encode (string value)
+    """
+    # in Python 2, a regular 'str' value is a bytes value already, and calling .encode() on it
+    # would trigger an implicit (ASCII) decode first, which fails when it includes non-ASCII characters
+    if not isinstance(msg, bytes):
+        msg = msg.encode('utf-8')
+    return msg
+
+
+def combine_regexes(regexes, named=True):
+    """
+    Combine specified (compiled) regular expressions into a single regular expression,
+    so only a single search is required to check whether any of them matches.
+
+    Regular expressions are only combined if that can be done safely, so they must not include
+    named groups (names could clash), backreferences (group numbers change) or inline global flags
+    (which would apply to all regular expressions); in Python 2, the total number of groups is also limited.
+
+    :param regexes: list of compiled regular expressions
+    :param named: wrap each regular expression in a named group 'g<index>',
+                  so the (first) one that matched can be determined via the 'lastgroup' attribute of a match;
+                  if False, non-capturing groups are used
+    :return: combined (compiled) regular expression, or None if the regular expressions can not be combined
+    """
+    if not regexes:
+        return None
+
+    default_flags = re.compile('').flags
+    for regex in regexes:
+        if regex.groupindex or regex.flags != default_flags or re.search(r'\\\d', regex.pattern):
+            return None
+
+    if sys.version_info[0] < 3:
+        groups_cnt = 1 + sum(regex.groups for regex in regexes)
+        if named:
+            groups_cnt += len(regexes)
+        if groups_cnt > PY2_MAX_REGEX_GROUPS:
+            _log.debug("Not combining regular expressions, too many groups (%d) for Python 2", groups_cnt)
+            return None
+
+    if named:
+        pattern = '|'.join('(?P<g%d>%s)' % (idx, regex.pattern) for (idx, regex) in enumerate(regexes))
+    else:
+        pattern = '|'.join('(?:%s)' % regex.pattern for regex in regexes)
+
+    try:
+        return re.compile(pattern)
+    except re.error as err:
+        _log.debug("Failed to combine regular expressions into a single regular expression: %s", err)
+        return None
+
+
+def get_output_from_process(proc, read_size=None, asynchronous=False, raw=False):
     """
     Get output from running process (that was opened with subprocess.Popen).
 
     :param proc: process to get output from
-    :param read_size: number of bytes of output to read (if None: read all output)
+    :param read_size: maximum number of bytes of output to read (if None: read all output)
     :param asynchronous: get output asynchronously
+    :param raw: return raw output (bytes), rather than decoding it to a string value
     """
 
     if asynchronous:
@@ -117,16 +240,22 @@ def get_output_from_process(proc, read_size=None, asynchronous=False):
         # see https://github.com/easybuilders/easybuild-framework/issues/3593
         output = asyncprocess.recv_some(proc, e=False)
     elif read_size:
-        output = proc.stdout.read(read_size)
+        # read directly from file descriptor (bypassing the buffered file object),
+        # so we get whatever output is available (up to read_size bytes) rather than waiting until
+        # read_size bytes of output were produced
+        output = os.read(proc.stdout.fileno(), read_size)
     else:
-        output = proc.stdout.read()
-
-    # need to be careful w.r.t. encoding since we want to obtain a string value,
-    # and the output may include non UTF-8 characters
-    # * in Python 2, .decode() returns a value of type 'unicode',
-    #   but we really want a regular 'str' value (which is also why we use 'ignore' for encoding errors)
-    # * in Python 3, .decode() returns a 'str' value when called on the 'bytes' value obtained from .read()
-    output = str(output.decode('ascii', 'ignore'))
+        # read all (remaining) output directly from file descriptor too, in large chunks until end of file
+        fd = proc.stdout.fileno()
+        chunks = []
+        chunk = os.read(fd, PIPE_READ_SIZE)
+        while chunk:
+            chunks.append(chunk)
+            chunk = os.read(fd, PIPE_READ_SIZE)
+        output = b''.join(chunks)
+
+    if not raw:
+        output = decode_output(output)
 
     return output
 
@@ -173,12 +302,13 @@ def run_cmd(cmd, log_ok=True, log_all=False, simple=False, inp=None, regexp=True
     if log_output or (trace and build_option('trace')):
         # collect output of running command in temporary log file, if desired
         fd, cmd_log_fn = tempfile.mkstemp(suffix='.log', prefix='easybuild-run_cmd-')
-        os.close(fd)
+        # use file descriptor of temporary file directly, no need to close it and open the file again;
+        # log file is opened in binary mode, so the (raw) output of the command can be written to it as is
         try:
-            cmd_log = open(cmd_log_fn, 'w')
-        except IOError as err:
+            cmd_log = os.fdopen(fd, 'wb')
+        except (IOError, OSError) as err:
             raise EasyBuildError("Failed to open temporary log file for output of command: %s", err)
-        _log.debug('run_cmd: Output of "%s" will be logged to %s' % (cmd, cmd_log_fn))
+        _log.debug('run_cmd: Output of "%s" will be logged to %s', cmd, cmd_log_fn)
     else:
         cmd_log_fn, cmd_log = None, None
 
@@ -205,8 +335,9 @@ def run_cmd(cmd, log_ok=True, log_all=False, simple=False, inp=None, regexp=True
         if path is None:
             path = cwd
         if verbose:
-            dry_run_msg("  running command \"%s\"" % cmd_msg, silent=build_option('silent'))
-            dry_run_msg("  (in %s)" % path, silent=build_option('silent'))
+            silent = build_option('silent')
+            dry_run_msg("  running command \"%s\"" % cmd_msg, silent=silent)
+            dry_run_msg("  (in %s)" % path, silent=silent)
 
         # make sure we get the type of the return value right
         if simple:
@@ -215,17 +346,18 @@ def run_cmd(cmd, log_ok=True, log_all=False, simple=False, inp=None, regexp=True
             # output, exit code
             return ('', 0)
 
-    try:
-        if path:
-            os.chdir(path)
-
-        _log.debug("run_cmd: running cmd %s (in %s)" % (cmd, os.getcwd()))
-    except OSError as err:
-        _log.warning("Failed to change to %s: %s" % (path, err))
+    # command is run in specified directory by passing it to subprocess.Popen,
+    # so no need to change the working directory of the EasyBuild process itself (and back again)
+    if path and not (os.path.isdir(path) and os.access(path, os.X_OK)):
+        _log.warning("Failed to change to %s: not an existing (accessible) directory", path)
         _log.info("running cmd %s in non-existing directory, might fail!", cmd)
+        path = None
+    work_dir = path or cwd
+
+    _log.debug("run_cmd: running cmd %s (in %s)", cmd, work_dir)
 
     if cmd_log:
-        cmd_log.write("# output for command: %s\n\n" % cmd_msg)
+        cmd_log.write(encode_log_msg("# output for command: %s\n\n" % cmd_msg))
 
     exec_cmd = "/bin/bash"
 
@@ -235,9 +367,7 @@ def run_cmd(cmd, log_ok=True, log_all=False, simple=False, inp=None, regexp=True
     if with_sysroot:
         sysroot = build_option('sysroot')
         if sysroot:
-            sysroot_bin_bash = os.path.join(sysroot, 'bin', 'bash')
-            if os.path.exists(sysroot_bin_bash):
-                exec_cmd = sysroot_bin_bash
+            exec_cmd = get_sysroot_bash(sysroot) or exec_cmd
 
     if not shell:
         if isinstance(cmd, list):
@@ -250,17 +380,22 @@ def run_cmd(cmd, log_ok=True, log_all=False, simple=False, inp=None, regexp=True
 
     _log.info("Using %s as shell for running cmd: %s", exec_cmd, cmd)
 
+    # no need to bother with hooks if no hooks implementation is specified
+    with_hooks = with_hooks and bool(build_option('hooks'))
     if with_hooks:
         hooks = load_hooks(build_option('hooks'))
-        hook_res = run_hook(RUN_SHELL_CMD, hooks, pre_step_hook=True, args=[cmd], kwargs={'work_dir': os.getcwd()})
+        hook_res = run_hook(RUN_SHELL_CMD, hooks, pre_step_hook=True, args=[cmd], kwargs={'work_dir': work_dir})
         if isinstance(hook_res, string_type):
             cmd, old_cmd = hook_res, cmd
             _log.info("Command to run was changed by pre-%s hook: '%s' (was: '%s')", RUN_SHELL_CMD, cmd, old_cmd)
 
-    _log.info('running cmd: %s ' % cmd)
+    _log.info('running cmd: %s ', cmd)
+    # note: close_fds=True rules out the use of posix_spawn by subprocess, but that's not a problem since
+    # recent Python versions use vfork on Linux, which also avoids copying the (page tables of the) parent process;
+    # we don't want to risk leaking file descriptors of the EasyBuild process into the command being run
     try:
         proc = subprocess.Popen(cmd, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                stdin=subprocess.PIPE, close_fds=True, executable=exec_cmd)
+                                stdin=subprocess.PIPE, close_fds=True, executable=exec_cmd, cwd=path or None)
     except OSError as err:
         raise EasyBuildError("run_cmd init cmd %s failed:%s", cmd, err)
 
@@ -269,10 +404,31 @@ def run_cmd(cmd, log_ok=True, log_all=False, simple=False, inp=None, regexp=True
     proc.stdin.close()
 
     if asynchronous:
-        return (proc, cmd, cwd, start_time, cmd_log)
+        # working directory in which command is run is passed as 'original working directory',
+        # so it can be passed down to the post-run_shell_cmd hook when the command completes
+        return (proc, cmd, work_dir, start_time, cmd_log)
     else:
         return complete_cmd(proc, cmd, cwd, start_time, cmd_log, log_ok=log_ok, log_all=log_all, simple=simple,
-                            regexp=regexp, stream_output=stream_output, trace=trace, with_hook=with_hooks)
+                            regexp=regexp, stream_output=stream_output, trace=trace, with_hook=with_hooks,
+                            work_dir=work_dir)
+
+
+def wait_for_async_cmds(procs, timeout=None):
+    """
+    Wait until output is available for (at least one of) the specified asynchronous commands,
+    so they don't need to be checked continuously.
+
+    :param procs: list of subprocess.Popen instances representing asynchronous commands
+    :param timeout: maximum time to wait (in seconds); wait until output is available if None
+
+    :result: list of subprocess.Popen instances for which output is available (or which reached end of output)
+    """
+    pipes = dict((proc.stdout.fileno(), proc) for proc in procs if proc.stdout and not proc.stdout.closed)
+    if pipes:
+        ready = select.select(list(pipes), [], [], timeout)[0]
+    else:
+        ready = []
+    return [pipes[fd] for fd in ready]
 
 
 def check_async_cmd(proc, cmd, owd, start_time, cmd_log, fail_on_error=True, output_read_size=1024, output=''):
@@ -281,7 +437,7 @@ def check_async_cmd(proc, cmd, owd, start_time, cmd_log, fail_on_error=True, out
 
     :param proc: subprocess.Popen instance representing asynchronous command
     :param cmd: command being run
-    :param owd: original working directory
+    :param owd: original working directory (working directory in which command is run)
     :param start_time: start time of command (datetime instance)
     :param cmd_log: log file to print command output to
     :param fail_on_error: raise EasyBuildError when command exited with an error
@@ -295,12 +451,12 @@ def check_async_cmd(proc, cmd, owd, start_time, cmd_log, fail_on_error=True, out
         if not isinstance(output_read_size, int) or output_read_size < 0:
             raise EasyBuildError("Number of output bytes to read should be a positive integer value (or zero)")
         add_out = get_output_from_process(proc, read_size=output_read_size)
-        _log.debug("Additional output from asynchronous command '%s': %s" % (cmd, add_out))
+        _log.debug("Additional output from asynchronous command '%s': %s", cmd, add_out)
         output += add_out
 
     exit_code = proc.poll()
     if exit_code is None:
-        _log.debug("Asynchronous command '%s' still running..." % cmd)
+        _log.debug("Asynchronous command '%s' still running...", cmd)
         done = False
     else:
         _log.debug("Asynchronous command '%s' completed!", cmd)
@@ -317,13 +473,13 @@ def check_async_cmd(proc, cmd, owd, start_time, cmd_log, fail_on_error=True, out
 
 
 def complete_cmd(proc, cmd, owd, start_time, cmd_log, log_ok=True, log_all=False, simple=False,
-                 regexp=True, stream_output=None, trace=True, output='', with_hook=True):
+                 regexp=True, stream_output=None, trace=True, output='', with_hook=True, work_dir=None):
     """
     Complete running of command represented by passed subprocess.Popen instance.
 
     :param proc: subprocess.Popen instance representing running command
     :param cmd: command being run
-    :param owd: original working directory
+    :param owd: original working directory (working directory in which command is run, if work_dir is not specified)
     :param start_time: start time of command (datetime instance)
     :param cmd_log: log file to print command output to
     :param log_ok: only run output/exit code for failing commands (exit code non-zero)
@@ -333,58 +489,72 @@ def complete_cmd(proc, cmd, owd, start_time, cmd_log, log_ok=True, log_all=False
     :param stream_output: enable streaming command output to stdout
     :param trace: print command being executed as part of trace output
     :param with_hook: trigger post run_shell_cmd hooks (if defined)
+    :param work_dir: working directory in which command was run (original working directory if None)
     """
-    # use small read size when streaming output, to make it stream more fluently
-    # read size should not be too small though, to avoid too much overhead
+    # use smaller read size when streaming output, to make it stream more fluently
     if stream_output:
-        read_size = 128
+        read_size = PIPE_READ_SIZE_STREAM
     else:
-        read_size = 1024 * 8
+        read_size = PIPE_READ_SIZE
+
+    # streamed output is written to the underlying binary buffer of stdout as is, if it is available
+    # (not in Python 2 or when stdout is redirected to a StringIO instance), to avoid decoding every chunk of output
+    stdout_buffer = getattr(sys.stdout, 'buffer', None) if stream_output else None
+    if stdout_buffer is not None:
+        # make sure that whatever was already written to stdout comes first
+        sys.stdout.flush()
+
+    def stream(out):
+        """Stream (raw) output of command to stdout."""
+        if stdout_buffer is None:
+            sys.stdout.write(decode_output(out))
+        else:
+            stdout_buffer.write(out)
+            stdout_buffer.flush()
 
-    stdouterr = output
+    # raw output is collected, and only decoded once when command completed;
+    # it can be written to the log file (and streamed) as is
+    raw_output = []
 
     try:
         ec = proc.poll()
         while ec is None:
             # need to read from time to time.
             # - otherwise the stdout/stderr buffer gets filled and it all stops working
-            output = get_output_from_process(proc, read_size=read_size)
+            out = get_output_from_process(proc, read_size=read_size, raw=True)
             if cmd_log:
-                cmd_log.write(output)
+                cmd_log.write(out)
             if stream_output:
-                sys.stdout.write(output)
-            stdouterr += output
+                stream(out)
+            raw_output.append(out)
             ec = proc.poll()
 
         # read remaining data (all of it)
-        output = get_output_from_process(proc)
+        out = get_output_from_process(proc, raw=True)
     finally:
         proc.stdout.close()
 
     if cmd_log:
-        cmd_log.write(output)
+        cmd_log.write(out)
         cmd_log.close()
     if stream_output:
-        sys.stdout.write(output)
-    stdouterr += output
+        stream(out)
+    raw_output.append(out)
 
-    if with_hook:
+    stdouterr = output + decode_output(b''.join(raw_output))
+
+    if with_hook and build_option('hooks'):
         hooks = load_hooks(build_option('hooks'))
         run_hook_kwargs = {
             'exit_code': ec,
             'output': stdouterr,
-            'work_dir': os.getcwd(),
+            'work_dir': work_dir or owd,
         }
         run_hook(RUN_SHELL_CMD, hooks, post_step_hook=True, args=[cmd], kwargs=run_hook_kwargs)
 
     if trace:
         trace_msg("command completed: exit %s, ran in %s" % (ec, time_str_since(start_time)))
 
-    try:
-        os.chdir(owd)
-    except OSError as err:
-        raise EasyBuildError("Failed to return to %s after executing command: %s", owd, err)
-
     return parse_cmd_output(cmd, stdouterr, ec, simple, log_all, log_ok, regexp)
 
 
@@ -401,7 +571,7 @@ def run_cmd_qa(cmd, qa, no_qa=None, log_ok=True, log_all=False, simple=False, re
     :param regexp: regex used to check the output for errors; if True it will use the default (see parse_log_for_error)
     :param std_qa: dictionary which maps question regex patterns to answers
     :param path: path to execute the command is; current working directory is used if unspecified
-    :param maxhits: maximum number of cycles (seconds) without being able to find a known question
+    :param maxhits: maximum time (in seconds) spent waiting without being able to find a known question
     :param trace: print command being executed as part of trace output
     """
     cwd = os.getcwd()
@@ -414,12 +584,12 @@ def run_cmd_qa(cmd, qa, no_qa=None, log_ok=True, log_all=False, simple=False, re
     if log_all or (trace and build_option('trace')):
         # collect output of running command in temporary log file, if desired
         fd, cmd_log_fn = tempfile.mkstemp(suffix='.log', prefix='easybuild-run_cmd_qa-')
-        os.close(fd)
+        # log file is opened in binary mode, so the (raw) output of the command can be written to it as is
         try:
-            cmd_log = open(cmd_log_fn, 'w')
-        except IOError as err:
+            cmd_log = os.fdopen(fd, 'wb')
+        except (IOError, OSError) as err:
             raise EasyBuildError("Failed to open temporary log file for output of interactive command: %s", err)
-        _log.debug('run_cmd_qa: Output of "%s" will be logged to %s' % (cmd, cmd_log_fn))
+        _log.debug('run_cmd_qa: Output of "%s" will be logged to %s', cmd, cmd_log_fn)
     else:
         cmd_log_fn, cmd_log = None, None
 
@@ -435,8 +605,9 @@ def run_cmd_qa(cmd, qa, no_qa=None, log_ok=True, log_all=False, simple=False, re
     if build_option('extended_dry_run'):
         if path is None:
             path = cwd
-        dry_run_msg("  running interactive command \"%s\"" % cmd, silent=build_option('silent'))
-        dry_run_msg("  (in %s)" % path, silent=build_option('silent'))
+        silent = build_option('silent')
+        dry_run_msg("  running interactive command \"%s\"" % cmd, silent=silent)
+        dry_run_msg("  (in %s)" % path, silent=silent)
         if cmd_log:
             cmd_log.close()
         if simple:
@@ -445,14 +616,14 @@ def run_cmd_qa(cmd, qa, no_qa=None, log_ok=True, log_all=False, simple=False, re
             # output, exit code
             return ('', 0)
 
-    try:
-        if path:
-            os.chdir(path)
+    # command is run in specified directory by passing it to asyncprocess.Popen (see run_cmd)
+    if path and not (os.path.isdir(path) and os.access(path, os.X_OK)):
+        _log.warning("Failed to change to %s: not an existing (accessible) directory", path)
+        _log.info("running cmd %s in non-existing directory, might fail!", cmd)
+        path = None
+    work_dir = path or cwd
 
-        _log.debug("run_cmd_qa: running cmd %s (in %s)" % (cmd, os.getcwd()))
-    except OSError as err:
-        _log.warning("Failed to change to %s: %s" % (path, err))
-        _log.info("running cmd %s in non-existing directory, might fail!" % cmd)
+    _log.debug("run_cmd_qa: running cmd %s (in %s)", cmd, work_dir)
 
     # Part 1: process the QandA dictionary
     # given initial set of Q and A (in dict), return dict of reg. exp. and A
@@ -461,18 +632,9 @@ def run_cmd_qa(cmd, qa, no_qa=None, log_ok=True, log_all=False, simple=False, re
     # - replace whitespace
     # - replace newline
 
-    def escape_special(string):
-        return re.sub(r"([\+\?\(\)\[\]\*\.\\\$])", r"\\\1", string)
-
-    split = r'[\s\n]+'
-    regSplit = re.compile(r"" + split)
-
     def process_QA(q, a_s):
-        splitq = [escape_special(x) for x in regSplit.split(q)]
-        regQtxt = split.join(splitq) + split.rstrip('+') + "*$"
-        # add optional split at the end
-        for i in [idx for idx, a in enumerate(a_s) if not a.endswith('\n')]:
-            a_s[i] += '\n'
+        splitq = [re.escape(x) for x in QA_WHITESPACE_REGEX.split(q)]
+        regQtxt = QA_WHITESPACE_PATTERN.join(splitq) + QA_PATTERN_SUFFIX
         regQ = re.compile(r"" + regQtxt)
         if regQ.search(q):
             return (a_s, regQ)
@@ -480,7 +642,7 @@ def run_cmd_qa(cmd, qa, no_qa=None, log_ok=True, log_all=False, simple=False, re
             raise EasyBuildError("runqanda: Question %s converted in %s does not match itself", q, regQtxt)
 
     def check_answers_list(answers):
-        """Make sure we have a list of answers (as strings)."""
+        """Make sure we have a list of answers (as strings, ending with a newline)."""
         if isinstance(answers, string_type):
             answers = [answers]
         elif not isinstance(answers, list):
@@ -488,58 +650,76 @@ def run_cmd_qa(cmd, qa, no_qa=None, log_ok=True, log_all=False, simple=False, re
                 cmd_log.close()
             raise EasyBuildError("Invalid type for answer on %s, no string or list: %s (%s)",
                                  question, type(answers), answers)
-        # list is manipulated when answering matching question, so return a copy
-        return answers[:]
+        # return a new list, so the list of answers that was passed in is not modified
+        return [a if a.endswith('\n') else a + '\n' for a in answers]
 
-    new_qa = {}
+    # compiled question patterns and corresponding answers are collected in a list of tuples,
+    # since they only need to be iterated over (in order) while the command is running;
+    # answers are cycled through when a question is asked multiple times
+    new_qa = []
     _log.debug("new_qa: ")
     for question, answers in qa.items():
         answers = check_answers_list(answers)
         (answers, regQ) = process_QA(question, answers)
-        new_qa[regQ] = answers
-        _log.debug("new_qa[%s]: %s" % (regQ.pattern, new_qa[regQ]))
+        new_qa.append((regQ, itertools.cycle(answers)))
+        _log.debug("new_qa[%s]: %s", regQ.pattern, answers)
 
-    new_std_qa = {}
+    new_std_qa = []
     if std_qa:
         for question, answers in std_qa.items():
-            regQ = re.compile(r"" + question + r"[\s\n]*$")
+            regQ = re.compile(question + QA_PATTERN_SUFFIX)
             answers = check_answers_list(answers)
-            for i in [idx for idx, a in enumerate(answers) if not a.endswith('\n')]:
-                answers[i] += '\n'
-            new_std_qa[regQ] = answers
-            _log.debug("new_std_qa[%s]: %s" % (regQ.pattern, new_std_qa[regQ]))
+            new_std_qa.append((regQ, itertools.cycle(answers)))
+            _log.debug("new_std_qa[%s]: %s", regQ.pattern, answers)
+
+    # questions (and corresponding answers) in order of priority: qa before std_qa
+    questions = new_qa + new_std_qa
+
+    # combine all question patterns into a single regular expression (with a named group per question),
+    # if possible, so the output only has to be scanned once to determine which question (if any) was asked
+    any_question = combine_regexes([regQ for (regQ, _) in questions])
 
     new_no_qa = []
     if no_qa:
         # simple statements, can contain wildcards
-        new_no_qa = [re.compile(r"" + x + r"[\s\n]*$") for x in no_qa]
+        new_no_qa = [re.compile(x + QA_PATTERN_SUFFIX) for x in no_qa]
 
-    _log.debug("New noQandA list is: %s" % [x.pattern for x in new_no_qa])
+    _log.debug("New noQandA list is: %s", [x.pattern for x in new_no_qa])
+
+    # combine non-questions into a single regular expression (if possible), so only a single search is required;
+    # compiled patterns are combined as they are, to retain the semantics of each pattern (incl. the suffix)
+    if len(new_no_qa) > 1:
+        no_qa_regex = combine_regexes(new_no_qa, named=False)
+        if no_qa_regex is not None:
+            new_no_qa = [no_qa_regex]
 
     # Part 2: Run the command and answer questions
     # - this needs asynchronous stdout
 
-    hooks = load_hooks(build_option('hooks'))
-    run_hook_kwargs = {
-        'interactive': True,
-        'work_dir': os.getcwd(),
-    }
-    hook_res = run_hook(RUN_SHELL_CMD, hooks, pre_step_hook=True, args=[cmd], kwargs=run_hook_kwargs)
-    if isinstance(hook_res, string_type):
-        cmd, old_cmd = hook_res, cmd
-        _log.info("Interactive command to run was changed by pre-%s hook: '%s' (was: '%s')",
-                  RUN_SHELL_CMD, cmd, old_cmd)
+    # no need to bother with hooks if no hooks implementation is specified
+    with_hooks = bool(build_option('hooks'))
+    if with_hooks:
+        hooks = load_hooks(build_option('hooks'))
+        run_hook_kwargs = {
+            'interactive': True,
+            'work_dir': work_dir,
+        }
+        hook_res = run_hook(RUN_SHELL_CMD, hooks, pre_step_hook=True, args=[cmd], kwargs=run_hook_kwargs)
+        if isinstance(hook_res, string_type):
+            cmd, old_cmd = hook_res, cmd
+            _log.info("Interactive command to run was changed by pre-%s hook: '%s' (was: '%s')",
+                      RUN_SHELL_CMD, cmd, old_cmd)
 
     # # Log command output
     if cmd_log:
-        cmd_log.write("# output for interactive command: %s\n\n" % cmd)
+        cmd_log.write(encode_log_msg("# output for interactive command: %s\n\n" % cmd))
 
     # Make sure we close the proc handles and the cmd_log file
     @contextlib.contextmanager
     def get_proc():
         try:
             proc = asyncprocess.Popen(cmd, shell=True, stdout=asyncprocess.PIPE, stderr=asyncprocess.STDOUT,
-                                      stdin=asyncprocess.PIPE, close_fds=True, executable='/bin/bash')
+                                      stdin=asyncprocess.PIPE, close_fds=True, executable='/bin/bash', cwd=path or None)
         except OSError as err:
             if cmd_log:
                 cmd_log.close()
@@ -556,109 +736,124 @@ def run_cmd_qa(cmd, qa, no_qa=None, log_ok=True, log_all=False, simple=False, re
 
     with get_proc() as proc:
         ec = proc.poll()
-        stdout_err = ''
+        # collect output in list of chunks (joined once command completed), to avoid repeatedly copying all output;
+        # only the tail of the output is needed to look for questions
+        stdout_err_chunks = []
+        stdout_err_tail = ''
+        stdout_err_len = 0
         old_len_out = -1
-        hit_count = 0
+        # time spent waiting without being able to find a known question (since last question was answered);
+        # actual time is tracked rather than number of cycles, since we only wait for as long as needed
+        nohits_time = 0
+        last_check = monotonic()
 
         while ec is None:
+            now = monotonic()
+            elapsed, last_check = now - last_check, now
+
             # need to read from time to time.
             # - otherwise the stdout/stderr buffer gets filled and it all stops working
             try:
-                out = get_output_from_process(proc, asynchronous=True)
+                raw_out = get_output_from_process(proc, asynchronous=True, raw=True)
 
                 if cmd_log:
-                    cmd_log.write(out)
-                stdout_err += out
+                    cmd_log.write(raw_out)
+                out = decode_output(raw_out)
+                if out:
+                    stdout_err_chunks.append(out)
+                    stdout_err_tail = (stdout_err_tail + out)[-QA_OUTPUT_TAIL_SIZE:]
+                    stdout_err_len += len(out)
             # recv_some used by get_output_from_process for getting asynchronous output may throw exception
             except (IOError, Exception) as err:
                 _log.debug("run_cmd_qa cmd %s: read failed: %s", cmd, err)
                 out = None
 
             hit = False
-            for question, answers in new_qa.items():
-                res = question.search(stdout_err)
-                if out and res:
-                    fa = answers[0] % res.groupdict()
-                    # cycle through list of answers
-                    last_answer = answers.pop(0)
-                    answers.append(last_answer)
-                    _log.debug("List of answers for question %s after cycling: %s", question.pattern, answers)
-
-                    _log.debug("run_cmd_qa answer %s question %s out %s", fa, question.pattern, stdout_err[-50:])
-                    asyncprocess.send_all(proc, fa)
-                    hit = True
-                    break
-            if not hit:
-                for question, answers in new_std_qa.items():
-                    res = question.search(stdout_err)
-                    if out and res:
-                        fa = answers[0] % res.groupdict()
-                        # cycle through list of answers
-                        last_answer = answers.pop(0)
-                        answers.append(last_answer)
-                        _log.debug("List of answers for question %s after cycling: %s", question.pattern, answers)
-
-                        _log.debug("run_cmd_qa answer %s std question %s out %s",
-                                   fa, question.pattern, stdout_err[-50:])
+            # questions are only answered right after they appeared in the output,
+            # so only look for them if new output was produced
+            if out:
+                if any_question is None:
+                    candidates = questions
+                else:
+                    res = any_question.search(stdout_err_tail)
+                    if res:
+                        # a question with higher priority may also match (further down in the output),
+                        # so only questions with lower priority than the one that was found can be ignored
+                        candidates = questions[:int(res.lastgroup[1:]) + 1]
+                    else:
+                        candidates = []
+
+                for question, answers in candidates:
+                    res = question.search(stdout_err_tail)
+                    if res:
+                        fa = next(answers) % res.groupdict()
+                        _log.debug("run_cmd_qa answer %s question %s out %s",
+                                   fa, question.pattern, stdout_err_tail[-50:])
                         asyncprocess.send_all(proc, fa)
                         hit = True
                         break
-                if not hit:
-                    if len(stdout_err) > old_len_out:
-                        old_len_out = len(stdout_err)
-                    else:
-                        noqa = False
-                        for r in new_no_qa:
-                            if r.search(stdout_err):
-                                _log.debug("runqanda: noQandA found for out %s", stdout_err[-50:])
-                                noqa = True
-                        if not noqa:
-                            hit_count += 1
-                else:
-                    hit_count = 0
-            else:
-                hit_count = 0
 
-            if hit_count > maxhits:
-                # explicitly kill the child process before exiting
+            if hit:
+                nohits_time = 0
+            else:
+                if stdout_err_len > old_len_out:
+                    old_len_out = stdout_err_len
+                else:
+                    noqa = False
+                    for r in new_no_qa:
+                        if r.search(stdout_err_tail):
+                            _log.debug("runqanda: noQandA found for out %s", stdout_err_tail[-50:])
+                            noqa = True
+                            break
+                    if not noqa:
+                        nohits_time += elapsed
+
+            if nohits_time > maxhits:
+                # explicitly kill the child process (and wait for it, to avoid leaving a zombie) before exiting;
+                # note: the child process is not a process group leader, so os.killpg can not be used here
                 try:
-                    os.killpg(proc.pid, signal.SIGKILL)
-                    os.kill(proc.pid, signal.SIGKILL)
+                    proc.kill()
+                    proc.wait()
                 except OSError as err:
                     _log.debug("run_cmd_qa exception caught when killing child process: %s", err)
-                _log.debug("run_cmd_qa: full stdouterr: %s", stdout_err)
+                _log.debug("run_cmd_qa: full stdouterr: %s", ''.join(stdout_err_chunks))
                 raise EasyBuildError("run_cmd_qa: cmd %s : Max nohits %s reached: end of output %s",
-                                     cmd, maxhits, stdout_err[-500:])
+                                     cmd, maxhits, stdout_err_tail[-500:])
 
-            # the sleep below is required to avoid exiting on unknown 'questions' too early (see above)
-            time.sleep(1)
+            # wait until more output is available rather than sleeping unconditionally,
+            # so we can respond to questions as soon as they appear;
+            # the timeout is required to avoid exiting on unknown 'questions' too early (see above);
+            # no need to wait right after answering a question, output is read again immediately
+            if not hit:
+                if proc.stdout:
+                    select.select([proc.stdout], [], [], 1)
+                else:
+                    time.sleep(1)
             ec = proc.poll()
 
         # Process stopped. Read all remaining data
         try:
             if proc.stdout:
-                out = get_output_from_process(proc)
-                stdout_err += out
+                raw_out = get_output_from_process(proc, raw=True)
+                stdout_err_chunks.append(decode_output(raw_out))
                 if cmd_log:
-                    cmd_log.write(out)
+                    cmd_log.write(raw_out)
         except IOError as err:
             _log.debug("runqanda cmd %s: remaining data read failed: %s", cmd, err)
 
-    run_hook_kwargs.update({
-        'interactive': True,
-        'exit_code': ec,
-        'output': stdout_err,
-    })
-    run_hook(RUN_SHELL_CMD, hooks, post_step_hook=True, args=[cmd], kwargs=run_hook_kwargs)
+        stdout_err = ''.join(stdout_err_chunks)
+
+    if with_hooks:
+        run_hook_kwargs.update({
+            'interactive': True,
+            'exit_code': ec,
+            'output': stdout_err,
+        })
+        run_hook(RUN_SHELL_CMD, hooks, post_step_hook=True, args=[cmd], kwargs=run_hook_kwargs)
 
     if trace:
         trace_msg("interactive command completed: exit %s, ran in %s" % (ec, time_str_since(start_time)))
 
-    try:
-        os.chdir(cwd)
-    except OSError as err:
-        raise EasyBuildError("Failed to return to %s after executing command: %s", cwd, err)
-
     return parse_cmd_output(cmd, stdout_err, ec, simple, log_all, log_ok, regexp)
 
 
@@ -694,15 +889,21 @@ def parse_cmd_output(cmd, stdouterr, ec, simple, log_all, log_ok, regexp):
         if check_ec:
             raise EasyBuildError('cmd "%s" exited with exit code %s and output:\n%s', cmd, ec, stdouterr)
         else:
-            _log.warning('cmd "%s" exited with exit code %s and output:\n%s' % (cmd, ec, stdouterr))
+            _log.warning('cmd "%s" exited with exit code %s and output:\n%s', cmd, ec, stdouterr)
     elif not ec:
         if log_all:
-            _log.info('cmd "%s" exited with exit code %s and output:\n%s' % (cmd, ec, stdouterr))
+            _log.info('cmd "%s" exited with exit code %s and output:\n%s', cmd, ec, stdouterr)
         else:
-            _log.debug('cmd "%s" exited with exit code %s and output:\n%s' % (cmd, ec, stdouterr))
+            _log.debug('cmd "%s" exited with exit code %s and output:\n%s', cmd, ec, stdouterr)
+
+    # parse the stdout/stderr for errors when strictness dictates this or when regexp is passed in;
+    # output of a successful command is not checked with the default regexp if that could only result in
+    # a warning being logged for potential errors (unless all output is logged anyway)
+    check_output = fail_on_error_match or regexp
+    if check_output and not ec and regexp is True and not fail_on_error_match and not log_all:
+        check_output = False
 
-    # parse the stdout/stderr for errors when strictness dictates this or when regexp is passed in
-    if fail_on_error_match or regexp:
+    if check_output:
         res = parse_log_for_error(stdouterr, regexp, stdout=False)
         if res:
             errors = "\n\t" + "\n\t".join([r[0] for r in res])
@@ -734,27 +935,40 @@ def parse_log_for_error(txt, regExp=None, stdout=True, msg=None):
     global errors_found_in_log
 
     if regExp and isinstance(regExp, bool):
-        regExp = r"(?<![(,-]|\w)(?:error|segmentation fault|failed)(?![(,-]|\.?\w)"
-        _log.debug('Using default regular expression: %s' % regExp)
+        reg = DEFAULT_ERROR_REGEX
+        regExp = reg.pattern
+        _log.debug('Using default regular expression: %s', regExp)
     elif isinstance(regExp, str):
-        pass
+        reg = re.compile(regExp, re.I)
     else:
         raise EasyBuildError("parse_log_for_error no valid regExp used: %s", regExp)
 
-    reg = re.compile(regExp, re.I)
-
     res = []
-    for line in txt.split('\n'):
-        r = reg.search(line)
-        if r:
-            res.append([line, r.groups()])
+    if reg is DEFAULT_ERROR_REGEX:
+        # default regular expression can only match within a single line,
+        # so we can search the whole text at once, and only determine the matching line for every match
+        r = reg.search(txt)
+        while r:
+            start = txt.rfind('\n', 0, r.start()) + 1
+            end = txt.find('\n', r.end())
+            if end == -1:
+                end = len(txt)
+            res.append([txt[start:end], r.groups()])
             errors_found_in_log += 1
+            # continue searching on the next line
+            r = reg.search(txt, end + 1)
+    else:
+        for line in txt.split('\n'):
+            r = reg.search(line)
+            if r:
+                res.append([line, r.groups()])
+                errors_found_in_log += 1
 
     if stdout and res:
         if msg:
-            _log.info("parse_log_for_error msg: %s" % msg)
-        _log.info("parse_log_for_error (some may be harmless) regExp %s found:\n%s" %
-                  (regExp, '\n'.join([x[0] for x in res])))
+            _log.info("parse_log_for_error msg: %s", msg)
+        _log.info("parse_log_for_error (some may be harmless) regExp %s found:\n%s",
+                  regExp, '\n'.join([x[0] for x in res]))
 
     return res
 
@@ -794,10 +1008,25 @@ def extract_errors_from_log(log_txt, reg_exps):
         except Exception as err:
             raise EasyBuildError("Invalid input: No regexp or tuple of regexp and action '%s': %s", str(cur), err)
 
+    # combine all regular expressions into a single one (with a named group for each of them),
+    # so only a single search is required for lines that don't match any of them (which is the common case)
+    combined_reg_exp = None
+    if len(re_tuples) > 1:
+        combined_reg_exp = combine_regexes([r for (r, _) in re_tuples])
+
     warnings = []
     errors = []
     for line in log_txt.split('\n'):
-        for reg_exp, action in re_tuples:
+        candidates = re_tuples
+        if combined_reg_exp is not None:
+            res = combined_reg_exp.search(line)
+            if res is None:
+                continue
+            # a regular expression that comes first may also match (further down the line),
+            # so only regular expressions that come after the one that was found can be ignored
+            candidates = re_tuples[:int(res.lastgroup[1:]) + 1]
+
+        for reg_exp, action in candidates:
             if reg_exp.search(line):
                 if action == ERROR:
                     errors.append(line)
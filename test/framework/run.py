@@ -41,6 +41,7 @@ import sys
 import tempfile
 import textwrap
 import time
+from collections import OrderedDict
 from test.framework.utilities import EnhancedTestCase, TestLoaderFiltered, init_config
 from unittest import TextTestRunner
 from easybuild.base.fancylogger import setLogLevelDebug
@@ -51,7 +52,7 @@ from easybuild.tools.build_log import EasyBuildError, init_logging, stop_logging
 from easybuild.tools.config import update_build_option
 from easybuild.tools.filetools import adjust_permissions, read_file, write_file
 from easybuild.tools.run import check_async_cmd, check_log_for_errors, complete_cmd, get_output_from_process
-from easybuild.tools.run import parse_log_for_error, run_cmd, run_cmd_qa
+from easybuild.tools.run import parse_log_for_error, run_cmd, run_cmd_qa, wait_for_async_cmds
 from easybuild.tools.config import ERROR, IGNORE, WARN
 from easybuild.tools.py2vs3 import subprocess_terminate
 
@@ -160,6 +161,48 @@ class RunTest(EnhancedTestCase):
             self.assertTrue(out.startswith('foo ') and out.endswith(' bar'))
             self.assertEqual(type(out), str)
 
+    def test_run_cmd_path(self):
+        """Test running command in specified directory with run_cmd and run_cmd_qa."""
+        cwd = os.getcwd()
+        test_dir = os.path.realpath(self.test_prefix)
+
+        (out, ec) = run_cmd("pwd", path=test_dir)
+        self.assertEqual(ec, 0)
+        self.assertEqual(out, test_dir + '\n')
+        # working directory of current process is not changed
+        self.assertTrue(os.path.samefile(os.getcwd(), cwd))
+
+        (out, ec) = run_cmd_qa("pwd", {}, path=test_dir)
+        self.assertEqual(ec, 0)
+        self.assertEqual(out, test_dir + '\n')
+        self.assertTrue(os.path.samefile(os.getcwd(), cwd))
+
+        # command is run in current working directory if specified path doesn't exist
+        (out, ec) = run_cmd("pwd", path=os.path.join(test_dir, 'nosuchdir'))
+        self.assertEqual(ec, 0)
+        self.assertTrue(os.path.samefile(out.strip(), cwd))
+
+        # same if specified path is not accessible
+        # (only checked if permissions are enforced, which is not the case when tests are run as root)
+        noexec_dir = os.path.join(test_dir, 'noexec')
+        os.mkdir(noexec_dir)
+        adjust_permissions(noexec_dir, stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH, add=False)
+        if not os.access(noexec_dir, os.X_OK):
+            for run_func in (run_cmd, lambda cmd, path: run_cmd_qa(cmd, {}, path=path)):
+                (out, ec) = run_func("pwd", path=noexec_dir)
+                self.assertEqual(ec, 0)
+                self.assertTrue(os.path.samefile(out.strip(), cwd))
+        adjust_permissions(noexec_dir, stat.S_IXUSR, add=True)
+
+        # empty path is ignored, command is run in current working directory
+        (out, ec) = run_cmd("pwd", path='')
+        self.assertEqual(ec, 0)
+        self.assertTrue(os.path.samefile(out.strip(), cwd))
+
+        (out, ec) = run_cmd_qa("pwd", {}, path='')
+        self.assertEqual(ec, 0)
+        self.assertTrue(os.path.samefile(out.strip(), cwd))
+
     def test_run_cmd_log(self):
         """Test logging of executed commands."""
         fd, logfile = tempfile.mkstemp(suffix='.log', prefix='eb-test-')
@@ -271,6 +314,11 @@ class RunTest(EnhancedTestCase):
             self.assertTrue(out.startswith('foo ') and out.endswith(' bar'))
             self.assertEqual(type(out), str)
 
+        # also test running command that includes non-ASCII characters
+        (out, ec) = run_cmd("echo 'café'", log_output=True)
+        self.assertEqual(ec, 0)
+        self.assertEqual(out, 'caf\n')
+
     def test_run_cmd_trace(self):
         """Test run_cmd under --trace"""
         # replace log.experimental with log.warning to allow experimental code
@@ -347,6 +395,43 @@ class RunTest(EnhancedTestCase):
         self.assertTrue(out.startswith("question\nanswer\nfoo "))
         self.assertTrue(out.endswith('bar'))
 
+        # special characters in questions are escaped
+        cmd = "echo 'value of x^2 {x>0}?'; read x; echo $x"
+        (out, ec) = run_cmd_qa(cmd, {'value of x^2 {x>0}?': 'b'})
+        self.assertEqual(ec, 0)
+        self.assertEqual(out, "value of x^2 {x>0}?\nb\n")
+
+    def test_run_cmd_qa_priority(self):
+        """Test whether run_cmd_qa answers question with highest priority if multiple questions match."""
+
+        cmd = "echo 'is this a question?'; read x; echo $x"
+
+        # questions specified in qa have priority over questions in std_qa,
+        # and first matching question is answered (even if another question matches earlier on in the output);
+        # use an ordered dict, since order of keys in a regular dict is not preserved in Python 2
+        qa = OrderedDict([('question?', 'answer1'), ('is this a question?', 'answer2')])
+        std_qa = {r'this .*\?': 'answer3'}
+        (out, ec) = run_cmd_qa(cmd, qa, std_qa=std_qa)
+        self.assertEqual(ec, 0)
+        self.assertEqual(out, "is this a question?\nanswer1\n")
+
+        (out, ec) = run_cmd_qa(cmd, {}, std_qa=std_qa)
+        self.assertEqual(ec, 0)
+        self.assertEqual(out, "is this a question?\nanswer3\n")
+
+        # patterns with inline global flags only apply those flags to themselves
+        cmd = "echo 'foo'; read x; echo got=$x"
+        (out, ec) = run_cmd_qa(cmd, {}, std_qa={'Foo': 'a', '(?i)o': 'b'}, maxhits=3)
+        self.assertEqual(ec, 0)
+        self.assertEqual(out, "foo\ngot=b\n")
+
+        # lots of questions (more than can be combined into a single regular expression in Python 2)
+        cmd = "echo 'question 7?'; read x; echo $x"
+        qa = dict(('question %d?' % i, 'a%d' % i) for i in range(101))
+        (out, ec) = run_cmd_qa(cmd, qa)
+        self.assertEqual(ec, 0)
+        self.assertEqual(out, "question 7?\na7\n")
+
     def test_run_cmd_qa_buffering(self):
         """Test whether run_cmd_qa uses unbuffered output."""
 
@@ -389,6 +474,11 @@ class RunTest(EnhancedTestCase):
         extra_pref = "# output for interactive command: echo 'n: '; read n; seq 1 $n\n\n"
         self.assertEqual(run_cmd_log_txt, extra_pref + "n: \n1\n2\n3\n4\n5\n")
 
+        # also test running command that includes non-ASCII characters
+        (out, ec) = run_cmd_qa("echo 'café'", {}, log_all=True)
+        self.assertEqual(ec, 0)
+        self.assertEqual(out, 'caf\n')
+
     def test_run_cmd_qa_trace(self):
         """Test run_cmd under --trace"""
         # replace log.experimental with log.warning to allow experimental code
@@ -444,6 +534,30 @@ class RunTest(EnhancedTestCase):
         self.assertEqual(out, "question\nanswer1\nquestion\nanswer2\n" * 2)
         self.assertEqual(ec, 0)
 
+    def test_run_cmd_qa_no_qa(self):
+        """Test specifying non-questions in run_cmd_qa."""
+        cmd = "echo 'waiting for 3 seconds...'; sleep 3; echo done"
+
+        error_pattern = "Max nohits 1 reached: end of output waiting for 3 seconds...$"
+        self.assertErrorRegex(EasyBuildError, error_pattern, run_cmd_qa, cmd, {}, maxhits=1)
+
+        no_qas = (
+            [r'waiting for [0-9]+ seconds\.\.\.'],
+            ['foo', r'waiting .*', 'bar'],
+            # (unnamed) groups in non-questions are fine too
+            [r'(foo|bar)', r'waiting for ([0-9]+) seconds\.\.\.'],
+        )
+        for no_qa in no_qas:
+            (out, ec) = run_cmd_qa(cmd, {}, no_qa=no_qa, maxhits=1)
+            self.assertEqual(out, "waiting for 3 seconds...\ndone\n")
+            self.assertEqual(ec, 0)
+
+        # combining non-questions should not change the semantics of patterns that include a top-level '|'
+        cmd = "echo 'Starting the build step now...'; sleep 3; echo done"
+        (out, ec) = run_cmd_qa(cmd, {}, no_qa=['Starting|Running', 'foo'], maxhits=1)
+        self.assertEqual(out, "Starting the build step now...\ndone\n")
+        self.assertEqual(ec, 0)
+
     def test_run_cmd_simple(self):
         """Test return value for run_cmd in 'simple' mode."""
         self.assertEqual(True, run_cmd("echo hello", simple=True))
@@ -481,6 +595,33 @@ class RunTest(EnhancedTestCase):
         errors = parse_log_for_error("error failed", True)
         self.assertEqual(len(errors), 1)
 
+    def test_run_cmd_potential_errors(self):
+        """Test checking of output of successful commands for potential errors."""
+        fd, logfile = tempfile.mkstemp(suffix='.log', prefix='eb-test-')
+        os.close(fd)
+
+        regex = re.compile("Found 1 potential error .* in output of echo 'an error occurred'")
+        cmd = "echo 'an error occurred'"
+
+        # output of successful command is not checked with default regexp, unless all output is logged
+        init_logging(logfile, silent=True)
+        self.assertEqual(run_cmd(cmd), ('an error occurred\n', 0))
+        stop_logging(logfile)
+        self.assertFalse(regex.search(read_file(logfile)))
+        write_file(logfile, '')
+
+        init_logging(logfile, silent=True)
+        self.assertEqual(run_cmd(cmd, log_all=True), ('an error occurred\n', 0))
+        stop_logging(logfile)
+        self.assertTrue(regex.search(read_file(logfile)))
+        write_file(logfile, '')
+
+        # output is always checked when custom regexp is specified
+        init_logging(logfile, silent=True)
+        self.assertEqual(run_cmd(cmd, regexp='error'), ('an error occurred\n', 0))
+        stop_logging(logfile)
+        self.assertTrue(regex.search(read_file(logfile)))
+
     def test_dry_run(self):
         """Test use of functions under (extended) dry run."""
         build_options = {
@@ -688,6 +829,29 @@ class RunTest(EnhancedTestCase):
         self.assertTrue(res['output'].startswith('start\n'))
         self.assertTrue(res['output'].endswith('\ndone\n'))
 
+    def test_wait_for_async_cmds(self):
+        """Test wait_for_async_cmds function."""
+        cmd_info1 = run_cmd("sleep 2; echo one", asynchronous=True)
+        cmd_info2 = run_cmd("sleep 10; echo two", asynchronous=True)
+        procs = [cmd_info1[0], cmd_info2[0]]
+
+        # no output available yet
+        self.assertEqual(wait_for_async_cmds(procs, timeout=0), [])
+
+        # output becomes available once first command completes
+        self.assertEqual(wait_for_async_cmds(procs, timeout=5), [cmd_info1[0]])
+        res = check_async_cmd(*cmd_info1)
+        while not res['done']:
+            res = check_async_cmd(*cmd_info1, output=res['output'])
+        self.assertEqual(res['output'], 'one\n')
+
+        # output of first command was already consumed
+        self.assertEqual(wait_for_async_cmds(procs, timeout=0), [])
+
+        cmd_info2[0].kill()
+        complete_cmd(*cmd_info2, simple=True, log_ok=False, trace=False)
+        self.assertEqual(wait_for_async_cmds(procs, timeout=0), [])
+
     def test_check_log_for_errors(self):
         fd, logfile = tempfile.mkstemp(suffix='.log', prefix='eb-test-')
         os.close(fd)
@@ -742,6 +906,12 @@ class RunTest(EnhancedTestCase):
         expected_msg = "Found 1 potential error(s) in command output:\n\tthe process crashed with 0"
         self.assertIn(expected_msg, read_file(logfile))
 
+        # lots of regular expressions (more than can be combined into a single one in Python 2),
+        # with or without (unnamed) groups
+        expected_msg = r"Found 1 error\(s\) in command output:\n\tfoo x5 bar$"
+        for reg_exps in (['x%d' % i for i in range(101)], [r'(x)(%d)\b' % i for i in range(40)]):
+            self.assertErrorRegex(EasyBuildError, expected_msg, check_log_for_errors, "OK\nfoo x5 bar", reg_exps)
+
     def test_run_cmd_with_hooks(self):
         """
         Test running command with run_cmd with pre/post run_shell_cmd hooks in place.
@@ -768,7 +938,7 @@ class RunTest(EnhancedTestCase):
                     msg = "post-run hook interactive '%s'" % cmd
                 else:
                     msg = "post-run hook '%s'" % cmd
-                msg += " (exit code: %s, output: '%s')" % (exit_code, output)
+                msg += " in %s (exit code: %s, output: '%s')" % (work_dir, exit_code, output)
                 print(msg)
         """)
         write_file(hooks_file, hooks_file_txt)
@@ -780,7 +950,23 @@ class RunTest(EnhancedTestCase):
 
         expected_stdout = '\n'.join([
             "pre-run hook 'make' in %s" % cwd,
-            "post-run hook 'echo make' (exit code: 0, output: 'make\n')",
+            "post-run hook 'echo make' in %s (exit code: 0, output: 'make\n')" % cwd,
+            '',
+        ])
+        self.assertEqual(stdout, expected_stdout)
+
+        # post-run hook also gets the working directory in which an asynchronous command was run
+        test_dir = os.path.realpath(self.test_prefix)
+        with self.mocked_stdout_stderr():
+            cmd_info = run_cmd("make", path=test_dir, asynchronous=True)
+            res = check_async_cmd(*cmd_info)
+            while not res['done']:
+                res = check_async_cmd(*cmd_info, output=res['output'])
+            stdout = self.get_stdout()
+
+        expected_stdout = '\n'.join([
+            "pre-run hook 'make' in %s" % test_dir,
+            "post-run hook 'echo make' in %s (exit code: 0, output: 'make\n')" % test_dir,
             '',
         ])
         self.assertEqual(stdout, expected_stdout)
@@ -791,7 +977,7 @@ class RunTest(EnhancedTestCase):
 
         expected_stdout = '\n'.join([
             "pre-run hook interactive 'sleep 2; make' in %s" % cwd,
-            "post-run hook interactive 'sleep 2; echo make' (exit code: 0, output: 'make\n')",
+            "post-run hook interactive 'sleep 2; echo make' in %s (exit code: 0, output: 'make\n')" % cwd,
             '',
         ])
         self.assertEqual(stdout, expected_stdout)